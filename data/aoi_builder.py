@@ -1,4 +1,11 @@
+import json
+from pathlib import Path
+
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import shapely
+from shapely.geometry import mapping
 from .paths import SEOUL_BOUNDARY, KOREA_RIVERS, AOI_SEOUL_HANGANG_2KM
 
 
@@ -10,33 +17,32 @@ def _to_polygon_only(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
         raise ValueError("Polygon / MultiPolygon geometry가 없습니다.")
 
     # 2) 전체를 하나로 union (MultiPolygon 될 수 있음)
-    geom = gdf.unary_union
+    geom = shapely.union_all(gdf.geometry.values)
 
-    # 3) GeoDataFrame으로 만들고 explode → 전부 Polygon 타입으로 맞추기
-    gdf_out = gpd.GeoDataFrame(geometry=[geom], crs=gdf.crs)
-    gdf_out = gdf_out.explode(index_parts=False)
+    # 3) 구성 폴리곤으로 분해 → 전부 Polygon 타입으로 맞추기
+    parts = shapely.get_parts(geom)
+    gdf_out = gpd.GeoDataFrame(geometry=parts, crs=gdf.crs)
 
     return gdf_out
 
 
 def build_seoul_hangang_aoi(buffer_m: int = 2000):
-    gdf_seoul = gpd.read_file(SEOUL_BOUNDARY)
-    gdf_riv   = gpd.read_file(KOREA_RIVERS)
+    gdf_seoul = gpd.read_file(SEOUL_BOUNDARY, engine="pyogrio")
+    gdf_riv   = gpd.read_file(KOREA_RIVERS, engine="pyogrio")
 
-    # CRS 설정/변환 (둘 다 WGS84로)
+    # CRS 설정/변환 (CRS 없으면 WGS84로 간주, 처리는 전부 3857에서 한 번에)
     if gdf_seoul.crs is None:
         gdf_seoul.set_crs(epsg=4326, inplace=True)
-    else:
-        gdf_seoul = gdf_seoul.to_crs(epsg=4326)
+    gdf_seoul = gdf_seoul.to_crs(epsg=3857)
 
     if gdf_riv.crs is None:
         gdf_riv.set_crs(epsg=4326, inplace=True)
-    else:
-        gdf_riv = gdf_riv.to_crs(epsg=4326)
+    gdf_riv = gdf_riv.to_crs(epsg=3857)
 
     # 한강 필터
     if "name" in gdf_riv.columns:
-        mask = gdf_riv["name"].astype(str).str.contains("한강|Hangang|Han River", na=False)
+        names = pa.array(gdf_riv["name"].fillna("").astype(str).to_numpy(), type=pa.string())
+        mask = pc.match_substring_regex(names, "한강|Hangang|Han River").to_numpy(zero_copy_only=False)
         gdf_hangang = gdf_riv[mask].copy()
         if gdf_hangang.empty:
             gdf_hangang = gdf_riv.copy()
@@ -47,22 +53,42 @@ def build_seoul_hangang_aoi(buffer_m: int = 2000):
     gdf_hangang = _to_polygon_only(gdf_hangang)
     gdf_seoul   = _to_polygon_only(gdf_seoul)
 
-    # 서울 영역과 교차
-    gdf_hangang_seoul = gpd.overlay(gdf_hangang, gdf_seoul, how="intersection")
+    # 서울 영역과 교차 (STRtree로 교차 후보 쌍만 골라 한 번에 intersection)
+    hangang_geoms = gdf_hangang.geometry.values
+    seoul_geoms = gdf_seoul.geometry.values
+    tree = shapely.STRtree(seoul_geoms)
+    left, right = tree.query(hangang_geoms, predicate="intersects")
+    inter = shapely.intersection(hangang_geoms[left], seoul_geoms[right])
+    inter = inter[~shapely.is_empty(inter)]
+    gdf_hangang_seoul = gpd.GeoDataFrame(geometry=inter, crs=gdf_hangang.crs)
 
-    # 버퍼 + AOI 생성
-    gdf_m = gdf_hangang_seoul.to_crs(epsg=3857)
-    gdf_buf = gdf_m.buffer(buffer_m)
-    gdf_buf = gpd.GeoDataFrame(geometry=gdf_buf, crs="EPSG:3857").to_crs(epsg=4326)
+    # 버퍼 + AOI 생성 (3857에서 dissolve 후 저장용으로만 WGS84로 변환)
+    gdf_buf = gdf_hangang_seoul.buffer(buffer_m)
+    gdf_buf = gpd.GeoDataFrame(geometry=gdf_buf, crs=gdf_hangang_seoul.crs)
 
-    gdf_aoi = gdf_buf.dissolve()
+    gdf_aoi = gdf_buf.dissolve().to_crs(epsg=4326)
     AOI_SEOUL_HANGANG_2KM.parent.mkdir(parents=True, exist_ok=True)
-    gdf_aoi.to_file(AOI_SEOUL_HANGANG_2KM, driver="GeoJSON")
+    _write_aoi_geojson(gdf_aoi, AOI_SEOUL_HANGANG_2KM)
     return AOI_SEOUL_HANGANG_2KM
 
 
-if __name__ == "__main__":
-    from pathlib import Path
+def _write_aoi_geojson(gdf: gpd.GeoDataFrame, path: Path) -> None:
+    """AOI 저장. dissolve 결과인 단일 feature는 드라이버 없이 바로 직렬화."""
+    if len(gdf) != 1:
+        gdf.to_file(path, driver="GeoJSON", engine="pyogrio")
+        return
 
+    fc = {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "properties": {},
+            "geometry": mapping(gdf.geometry.iloc[0]),
+        }],
+    }
+    path.write_text(json.dumps(fc), encoding="utf-8")
+
+
+if __name__ == "__main__":
     out = build_seoul_hangang_aoi()
     print(f"AOI saved to: {Path(out).resolve()}")
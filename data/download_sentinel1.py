@@ -2,11 +2,16 @@ from __future__ import annotations
 
 import json
 import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import requests
+import shapely
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 # 프로젝트 내부 경로
 from data.paths import (
@@ -40,15 +45,86 @@ DOWNLOAD_URL = os.getenv(
     "https://download.dataspace.copernicus.eu/odata/v1",
 )
 
+# 다운로드 복사 블록 크기 (1 MiB)
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# 액세스 토큰 캐시 (만료 60초 전부터는 재발급)
+TOKEN_CACHE_PATH = CONFIG_DIR / ".cdse_token.json"
+TOKEN_EXPIRY_MARGIN_S = 60
+
 
 # -----------------------------
 # 2) Auth: 토큰 + Session
 # -----------------------------
+def _request_token(data: Dict[str, str]) -> Dict[str, Any]:
+    resp = requests.post(TOKEN_URL, data=data, timeout=60)
+    resp.raise_for_status()
+    token_json = resp.json()
+    if not token_json.get("access_token"):
+        raise RuntimeError(
+            f"토큰 응답에 access_token 없음: keys={list(token_json.keys())}"
+        )
+    return token_json
+
+
+def _load_cached_token() -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(TOKEN_CACHE_PATH.read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_token(token_json: Dict[str, Any], username: str) -> str:
+    """
+    토큰 응답을 계정/만료 시각과 함께 캐시 파일(0600)에 저장하고 access_token 반환.
+    캐시 저장에 실패해도(읽기 전용 config/ 등) 발급받은 토큰은 그대로 반환한다.
+    """
+    now = time.time()
+    cache = {
+        "username": username,
+        "access_token": token_json["access_token"],
+        "expires_at": now + token_json.get("expires_in", 0),
+        "refresh_token": token_json.get("refresh_token"),
+        "refresh_expires_at": now + token_json.get("refresh_expires_in", 0),
+    }
+    try:
+        fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            # 이미 있던 파일은 O_CREAT 모드가 적용되지 않으므로 권한을 다시 맞춘다
+            os.fchmod(f.fileno(), 0o600)
+            json.dump(cache, f)
+    except OSError as e:
+        print(f"[WARN] 토큰 캐시 저장 실패: {e}")
+    return cache["access_token"]
+
+
 def get_access_token() -> str:
+    """
+    CDSE 액세스 토큰 반환.
+    같은 계정(COPERNICUS_USERNAME)의 캐시된 토큰이 유효하면 그대로 쓰고,
+    만료됐으면 refresh_token으로 갱신, 그것도 안 되면 username/password로 새로 발급한다.
+    """
     username = os.getenv("COPERNICUS_USERNAME")
     password = os.getenv("COPERNICUS_PASSWORD")
     totp = os.getenv("COPERNICUS_TOTP")  # 2FA 안 쓰면 None
 
+    now = time.time()
+    cache = _load_cached_token()
+    if cache and username and cache.get("username") == username:
+        if now < cache.get("expires_at", 0) - TOKEN_EXPIRY_MARGIN_S:
+            return cache["access_token"]
+
+        refresh_token = cache.get("refresh_token")
+        if refresh_token and now < cache.get("refresh_expires_at", 0) - TOKEN_EXPIRY_MARGIN_S:
+            try:
+                return _save_token(_request_token({
+                    "grant_type": "refresh_token",
+                    "client_id": "cdse-public",
+                    "refresh_token": refresh_token,
+                }), username)
+            except requests.HTTPError:
+                pass  # refresh 실패 → 아래 password grant로
+
     if not username or not password:
         raise RuntimeError(
             "COPERNICUS_USERNAME / COPERNICUS_PASSWORD 환경변수를 설정해주세요 "
@@ -64,21 +140,17 @@ def get_access_token() -> str:
     if totp:
         data["totp"] = totp
 
-    resp = requests.post(TOKEN_URL, data=data, timeout=60)
-    resp.raise_for_status()
-    token_json = resp.json()
-    access_token = token_json.get("access_token")
-    if not access_token:
-        raise RuntimeError(
-            f"토큰 응답에 access_token 없음: keys={list(token_json.keys())}"
-        )
-    return access_token
+    return _save_token(_request_token(data), username)
 
 
 def get_session() -> requests.Session:
     token = get_access_token()
     s = requests.Session()
     s.headers.update({"Authorization": f"Bearer {token}"})
+    # 검색/다운로드를 동시에 돌리므로 keep-alive 커넥션 풀을 넉넉하게
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
     return s
 
 
@@ -97,8 +169,7 @@ def aoi_geojson_to_geography_wkt(geojson_path: Path) -> str:
     if not geojson_path.exists():
         raise FileNotFoundError(f"AOI 파일 없음: {geojson_path}")
 
-    with geojson_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = json.loads(geojson_path.read_bytes())
 
     # FeatureCollection / 단일 Feature 모두 처리
     if data.get("type") == "FeatureCollection":
@@ -117,14 +188,12 @@ def aoi_geojson_to_geography_wkt(geojson_path: Path) -> str:
             f"현재 코드는 Polygon AOI만 지원합니다. geometry.type={geom.get('type')}"
         )
 
-    # 첫 번째 링(외곽 링)만 사용
-    coords = geom["coordinates"][0]  # [[lon, lat], [lon, lat], ...]
-    # 폴리곤은 시작점과 끝점이 같아야 함 (안 그러면 OData에서 에러)
-    if coords[0] != coords[-1]:
-        coords.append(coords[0])
-
-    coord_str = ", ".join(f"{lon} {lat}" for lon, lat in coords)
-    wkt_polygon = f"POLYGON(({coord_str}))"
+    # 첫 번째 링(외곽 링)만 사용 — shapely가 링을 자동으로 닫아줌
+    # (폴리곤은 시작점과 끝점이 같아야 함, 안 그러면 OData에서 에러)
+    polygon = shapely.Polygon(geom["coordinates"][0])
+    wkt_polygon = shapely.to_wkt(polygon, rounding_precision=7)
+    # OData geography 리터럴은 "POLYGON((" 형태 (공백 없음)
+    wkt_polygon = wkt_polygon.replace("POLYGON ((", "POLYGON((", 1)
 
     # 결과: geography'SRID=4326;POLYGON((lon lat, ...))'
     return f"geography'SRID=4326;{wkt_polygon}'"
@@ -202,10 +271,10 @@ def download_product_zip(
         filename = f"{product_id}.zip"
 
     out_path = out_dir / filename
-    with out_path.open("wb") as f:
-        for chunk in resp.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+    # 1 MiB 블록 단위로 raw 스트림을 바로 파일에 복사 (gzip 등 인코딩은 해제)
+    resp.raw.decode_content = True
+    with out_path.open("wb", buffering=DOWNLOAD_CHUNK_SIZE) as f:
+        shutil.copyfileobj(resp.raw, f, length=DOWNLOAD_CHUNK_SIZE)
 
     return out_path
 
@@ -236,51 +305,50 @@ def main():
     dry_start_iso = f"{dry_start_date}T00:00:00.000Z"
     dry_end_iso = f"{dry_end_date}T23:59:59.999Z"
 
-    # (4) 홍수 기간에서 검색 후 1장 다운로드
-    flood_products = search_s1_grd(
-        session,
-        start_iso=flood_start_iso,
-        end_iso=flood_end_iso,
-        aoi_geog_wkt=aoi_geog,
-        top=5,
-    )
-    if not flood_products:
-        print("[WARN] 홍수 기간에 해당하는 Sentinel-1 제품이 없습니다.")
-    else:
-        flood_first = flood_products[0]
-        pid = flood_first["Id"]
-        name = flood_first["Name"]
-        print("[INFO] 홍수용 제품 선택:", name)
-        out_path = download_product_zip(
+    # (4) 홍수/평시 기간 검색을 동시에 실행
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        f_flood = ex.submit(
+            search_s1_grd,
             session,
-            product_id=pid,
-            out_dir=DATA_S1_RAW_FLOOD,
-            filename=f"{name}.zip",
+            start_iso=flood_start_iso,
+            end_iso=flood_end_iso,
+            aoi_geog_wkt=aoi_geog,
+            top=5,
         )
-        print("[INFO] 홍수 제품 다운로드 완료:", out_path)
-
-    # (5) 평시 기간에서 검색 후 1장 다운로드
-    dry_products = search_s1_grd(
-        session,
-        start_iso=dry_start_iso,
-        end_iso=dry_end_iso,
-        aoi_geog_wkt=aoi_geog,
-        top=5,
-    )
-    if not dry_products:
-        print("[WARN] 평시 기간에 해당하는 Sentinel-1 제품이 없습니다.")
-    else:
-        dry_first = dry_products[0]
-        pid = dry_first["Id"]
-        name = dry_first["Name"]
-        print("[INFO] 평시용 제품 선택:", name)
-        out_path = download_product_zip(
+        f_dry = ex.submit(
+            search_s1_grd,
             session,
-            product_id=pid,
-            out_dir=DATA_S1_RAW_DRY,
-            filename=f"{name}.zip",
+            start_iso=dry_start_iso,
+            end_iso=dry_end_iso,
+            aoi_geog_wkt=aoi_geog,
+            top=5,
         )
-        print("[INFO] 평시 제품 다운로드 완료:", out_path)
+        flood_products = f_flood.result()
+        dry_products = f_dry.result()
+
+        # (5) 기간별로 첫 번째 제품 1장씩 동시에 다운로드
+        downloads = []
+        for label, products, out_dir in (
+            ("홍수", flood_products, DATA_S1_RAW_FLOOD),
+            ("평시", dry_products, DATA_S1_RAW_DRY),
+        ):
+            if not products:
+                print(f"[WARN] {label} 기간에 해당하는 Sentinel-1 제품이 없습니다.")
+                continue
+            first = products[0]
+            name = first["Name"]
+            print(f"[INFO] {label}용 제품 선택:", name)
+            fut = ex.submit(
+                download_product_zip,
+                session,
+                product_id=first["Id"],
+                out_dir=out_dir,
+                filename=f"{name}.zip",
+            )
+            downloads.append((label, fut))
+
+        for label, fut in downloads:
+            print(f"[INFO] {label} 제품 다운로드 완료:", fut.result())
 
 
 if __name__ == "__main__":
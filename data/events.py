@@ -3,13 +3,20 @@ import yaml
 from pathlib import Path
 from .paths import CONFIG_DIR
 
+# libyaml(C) 로더가 있으면 사용, 없으면 순수 Python SafeLoader
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+
 def load_event(name: str):
     """
     name: 예) 'seoul_hangang_2020'
     """
     cfg_path = CONFIG_DIR / f"event_{name}.yaml"
-    with cfg_path.open(encoding="utf-8") as f:
-        return yaml.safe_load(f)
+    with cfg_path.open("rb") as f:
+        return yaml.load(f, Loader=_Loader)
 
 if __name__ == "__main__":
     cfg = load_event("seoul_hangang_2020")
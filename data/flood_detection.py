@@ -11,8 +11,13 @@ Change Detection 방식으로 홍수 전/후 SAR 이미지를 비교하여
 - 변화량(dry - flood)이 임계값 이상인 픽셀 = 침수 영역
 """
 
+import gzip
+
 import numpy as np
 import rasterio
+from rasterio.crs import CRS
+from rasterio.env import GDALVersion
+from rasterio.enums import Resampling
 from rasterio.features import shapes
 import geopandas as gpd
 from shapely.geometry import shape
@@ -23,16 +28,89 @@ from paths import (
     DATA_S1_RAW_DRY,
     DATA_INUNDATION_SEOUL_HANGANG_2KM,
 )
+from pixel_area import row_pixel_areas_m2
+
+
+# SAR dB 값은 int16 (dB × DB_SCALE)로 양자화해서 처리/저장 (±327.67 dB 범위)
+DB_SCALE = 100
+_INT16 = np.iinfo(np.int16)
+# nodata / NaN 픽셀은 int16 최솟값으로 표시하고 유효 dB 값은 그 위로 clip
+DB_NODATA = int(_INT16.min)
+_DB_VALID_MIN = DB_NODATA + 1
+# flood mask nodata (0 = 비침수, 1 = 침수)
+MASK_NODATA = 255
+
+# GeoTIFF 출력 옵션: 512 타일 + 멀티스레드 압축 (ZSTD는 GDAL >= 3.4, 아니면 DEFLATE)
+GTIFF_WRITE_OPTIONS = {
+    "tiled": True,
+    "blockxsize": 512,
+    "blockysize": 512,
+    "compress": "zstd" if GDALVersion.runtime().at_least("3.4") else "deflate",
+    "predictor": 2,
+    "num_threads": "all_cpus",
+}
 
+# 내부 overview 배율 (대시보드 썸네일을 축소 해상도에서 바로 읽기 위함)
+OVERVIEW_LEVELS = (2, 4, 8, 16)
 
-def load_sar_image(filepath: Path) -> tuple[np.ndarray, dict]:
-    """SAR GeoTIFF 로드"""
-    with rasterio.open(filepath) as src:
-        data = src.read(1)
-        profile = src.profile.copy()
-        transform = src.transform
-        crs = src.crs
-    return data, {"profile": profile, "transform": transform, "crs": crs}
+
+def quantize_db(scaled: np.ndarray, invalid: np.ndarray | None = None) -> np.ndarray:
+    """
+    dB × DB_SCALE 값(float)을 int16으로 양자화
+
+    반올림 후 [DB_NODATA + 1, int16 최댓값]으로 clip하고,
+    NaN 픽셀(과 invalid가 True인 픽셀)은 DB_NODATA로 채웁니다.
+    반올림은 입력 배열에 in-place로 수행합니다.
+    """
+    nodata_mask = np.isnan(scaled)
+    if invalid is not None:
+        nodata_mask |= invalid
+
+    np.rint(scaled, out=scaled)
+    # clip은 int16 버퍼에 바로 써서 astype 복사를 생략
+    out = np.empty(scaled.shape, dtype=np.int16)
+    np.clip(scaled, _DB_VALID_MIN, _INT16.max, out=out, casting="unsafe")
+    out[nodata_mask] = DB_NODATA
+    return out
+
+
+def read_db_int16(src, window=None) -> np.ndarray:
+    """
+    밴드 1을 int16 (dB × DB_SCALE)로 읽기
+
+    이미 같은 스케일로 양자화된 int16 파일은 변환 없이 그대로 읽고,
+    float 파일은 scale/offset을 적용한 뒤 quantize_db로 변환합니다.
+    nodata / NaN 픽셀은 DB_NODATA로 채웁니다.
+    """
+    scale, offset = src.scales[0], src.offsets[0]
+    nodata = src.nodata
+    if src.dtypes[0] == "int16" and np.isclose(scale, 1 / DB_SCALE) and offset == 0:
+        data = src.read(1, window=window)
+        if nodata is not None and nodata != DB_NODATA:
+            data[data == nodata] = DB_NODATA
+        return data
+
+    data = src.read(1, window=window, out_dtype=np.float32)
+    invalid = None
+    if nodata is not None and not np.isnan(nodata):
+        invalid = data == nodata
+
+    # scale/offset은 필요할 때만 적용 (NaN은 그대로 NaN)
+    factor = scale * DB_SCALE
+    if factor != 1:
+        data *= factor
+    if offset != 0:
+        data += offset * DB_SCALE
+    return quantize_db(data, invalid)
+
+
+def build_overviews(path: Path, resampling: Resampling = Resampling.nearest):
+    """GeoTIFF에 내부 overview 추가 (래스터보다 작아지는 배율까지만)"""
+    with rasterio.open(path, "r+") as dst:
+        levels = [f for f in OVERVIEW_LEVELS if min(dst.width, dst.height) // f >= 1]
+        if levels:
+            dst.build_overviews(levels, resampling)
+            dst.update_tags(ns="rio_overview", resampling=resampling.name)
 
 
 def change_detection(
@@ -43,74 +121,191 @@ def change_detection(
     """
     Change Detection으로 침수 영역 탐지
 
+    정수형 입력은 read_db_int16과 같은 int16 (dB × DB_SCALE) 양자화 값으로
+    보고, int32로 빼서 overflow를 막고 임계값도 같은 스케일로 비교합니다.
+    어느 한쪽이라도 DB_NODATA(float 입력은 NaN)인 픽셀은 침수로 판정하지 않고
+    변화량도 DB_NODATA(NaN)로 둡니다.
+
     Args:
-        dry_image: 평시 SAR 이미지 (dB)
-        flood_image: 홍수기 SAR 이미지 (dB)
+        dry_image: 평시 SAR 이미지 (dB 또는 dB × DB_SCALE)
+        flood_image: 홍수기 SAR 이미지 (dB 또는 dB × DB_SCALE)
         threshold: 변화량 임계값 (dB). 기본값 3.0 dB
 
     Returns:
-        Binary mask (1 = 침수, 0 = 비침수)
+        Binary mask (1 = 침수, 0 = 비침수), 변화량 (입력과 같은 스케일, 정수형은 int16)
     """
+    # 임계값 적용 결과는 bool 버퍼에 바로 받아 uint8로 view (astype 복사 없음)
+    flood_mask = np.empty(dry_image.shape, dtype=np.bool_)
+
     # 변화량 계산 (평시 - 홍수기)
     # 양수 = 홍수기에 backscatter 감소 = 물에 잠김
-    change = dry_image - flood_image
-
-    # 임계값 적용
-    flood_mask = (change > threshold).astype(np.uint8)
+    if np.issubdtype(dry_image.dtype, np.integer):
+        change = np.empty(dry_image.shape, dtype=np.int32)
+        np.subtract(dry_image, flood_image, out=change, dtype=np.int32)
+        np.greater(change, int(round(threshold * DB_SCALE)), out=flood_mask)
+
+        invalid = (dry_image == DB_NODATA) | (flood_image == DB_NODATA)
+        flood_mask[invalid] = False
+        np.clip(change, _DB_VALID_MIN, _INT16.max, out=change)
+        change[invalid] = DB_NODATA
+        change = change.astype(np.int16)
+    else:
+        # NaN과의 비교는 False라서 nodata 픽셀은 자동으로 비침수
+        change = np.empty_like(dry_image)
+        np.subtract(dry_image, flood_image, out=change)
+        np.greater(change, threshold, out=flood_mask)
 
-    return flood_mask, change
+    return flood_mask.view(np.uint8), change
 
 
-def calculate_flood_area(
-    flood_mask: np.ndarray,
+def flood_area_stats(
+    row_flood_pixels: np.ndarray,
+    total_pixels: int,
     transform: rasterio.Affine,
-    crs: str = "EPSG:4326"
+    crs=None
 ) -> dict:
     """
-    침수 면적 계산
+    행별 침수 픽셀 수로부터 침수 면적 통계 계산
+
+    픽셀 면적은 대시보드와 같은 pixel_area.row_pixel_areas_m2로 계산합니다.
 
     Args:
-        flood_mask: Binary flood mask
+        row_flood_pixels: 행별 침수 픽셀 수 (래스터 높이 길이)
+        total_pixels: 전체 픽셀 수
         transform: GeoTIFF transform
-        crs: 좌표계
+        crs: 좌표계 (None이면 WGS84로 간주)
 
     Returns:
         dict: 면적 통계
     """
-    # 픽셀 크기 계산 (도 단위를 미터로 근사 변환)
-    # 서울 위도 37.5도 기준: 1도 ≈ 88.8km (위도), 111km (경도) × cos(37.5°) ≈ 88km
-    pixel_width_deg = abs(transform.a)
-    pixel_height_deg = abs(transform.e)
-
-    # 미터로 변환 (대략적인 값)
-    lat_center = 37.55  # 서울 위도
-    m_per_deg_lat = 111320  # 위도 1도당 미터
-    m_per_deg_lon = 111320 * np.cos(np.radians(lat_center))
-
-    pixel_width_m = pixel_width_deg * m_per_deg_lon
-    pixel_height_m = pixel_height_deg * m_per_deg_lat
-    pixel_area_m2 = pixel_width_m * pixel_height_m
-
-    # 침수 픽셀 수
-    flood_pixels = np.sum(flood_mask == 1)
-    total_pixels = flood_mask.size
+    if crs is not None:
+        crs = CRS.from_user_input(crs)
+    row_areas_m2 = row_pixel_areas_m2(transform, crs, len(row_flood_pixels))
 
     # 면적 계산
-    flood_area_m2 = flood_pixels * pixel_area_m2
+    flood_pixels = int(np.sum(row_flood_pixels))
+    flood_area_m2 = float(np.dot(row_flood_pixels, row_areas_m2))
     flood_area_km2 = flood_area_m2 / 1_000_000
     flood_area_ha = flood_area_m2 / 10_000
 
     return {
-        "flood_pixels": int(flood_pixels),
+        "flood_pixels": flood_pixels,
         "total_pixels": int(total_pixels),
-        "flood_ratio": float(flood_pixels / total_pixels),
-        "pixel_size_m": (pixel_width_m, pixel_height_m),
+        "flood_ratio": flood_pixels / total_pixels if total_pixels > 0 else 0.0,
         "flood_area_m2": flood_area_m2,
         "flood_area_km2": flood_area_km2,
         "flood_area_ha": flood_area_ha,
     }
 
 
+def detect_flood_blocks(
+    dry_path: Path,
+    flood_path: Path,
+    mask_path: Path,
+    change_path: Path,
+    threshold: float = 3.0,
+    block_size: int = 512
+) -> dict:
+    """
+    블록(윈도우) 단위 Change Detection
+
+    평시/홍수기 SAR 이미지를 블록 단위로 읽어 change_detection을 수행하고,
+    flood mask와 변화량 맵을 같은 윈도우에 바로 기록합니다.
+    메모리 사용량은 장면 전체가 아니라 블록 크기에 비례합니다.
+
+    Args:
+        dry_path: 평시 SAR GeoTIFF
+        flood_path: 홍수기 SAR GeoTIFF
+        mask_path: Flood mask 출력 경로
+        change_path: 변화량 맵 출력 경로
+        threshold: 변화량 임계값 (dB)
+        block_size: 출력 GeoTIFF 타일 크기 (픽셀)
+
+    Returns:
+        dict: 누적 통계 (픽셀 수, 변화량 범위, 평균 등) 및 transform/crs
+    """
+    mask_path.parent.mkdir(parents=True, exist_ok=True)
+    change_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with rasterio.open(dry_path) as dry_src, rasterio.open(flood_path) as flood_src:
+        if dry_src.shape != flood_src.shape:
+            raise ValueError(
+                f"평시/홍수기 이미지 크기가 다릅니다: {dry_src.shape} vs {flood_src.shape}"
+            )
+
+        profile = flood_src.profile.copy()
+        profile.update(GTIFF_WRITE_OPTIONS, count=1, blockxsize=block_size, blockysize=block_size)
+        mask_profile = {**profile, "dtype": rasterio.uint8, "nodata": MASK_NODATA}
+        change_profile = {**profile, "dtype": rasterio.int16, "nodata": DB_NODATA}
+
+        row_flood_pixels = np.zeros(flood_src.height, dtype=np.int64)
+        valid_pixels = 0
+        change_min, change_max = int(_INT16.max), DB_NODATA
+        dry_sum = flood_sum = 0
+
+        with rasterio.open(mask_path, 'w', **mask_profile) as mask_dst, \
+                rasterio.open(change_path, 'w', **change_profile) as change_dst:
+            # 변화량 맵도 int16 (dB × DB_SCALE)로 저장
+            change_dst.scales = (1 / DB_SCALE,)
+            change_dst.offsets = (0.0,)
+
+            for _, window in mask_dst.block_windows(1):
+                dry_block = read_db_int16(dry_src, window=window)
+                flood_block = read_db_int16(flood_src, window=window)
+
+                block_mask, block_change = change_detection(dry_block, flood_block, threshold)
+                valid = block_change != DB_NODATA
+
+                # 통계는 유효 픽셀만 (nodata 픽셀은 mask에 MASK_NODATA로 기록)
+                row_off = window.row_off
+                row_flood_pixels[row_off:row_off + window.height] += np.count_nonzero(block_mask, axis=1)
+                valid_pixels += int(np.count_nonzero(valid))
+                change_min = min(change_min, int(block_change.min(initial=_INT16.max, where=valid)))
+                change_max = max(change_max, int(block_change.max(initial=DB_NODATA, where=valid)))
+                dry_sum += int(dry_block.sum(dtype=np.int64, where=valid))
+                flood_sum += int(flood_block.sum(dtype=np.int64, where=valid))
+
+                block_mask[~valid] = MASK_NODATA
+                mask_dst.write(block_mask, 1, window=window)
+                change_dst.write(block_change, 1, window=window)
+
+            # 유효 픽셀이 없으면 범위/평균은 NaN
+            n = valid_pixels or np.nan
+            db_stats = {
+                "change_min": change_min / DB_SCALE if valid_pixels else np.nan,
+                "change_max": change_max / DB_SCALE if valid_pixels else np.nan,
+                "dry_mean": dry_sum / n / DB_SCALE,
+                "flood_mean": flood_sum / n / DB_SCALE,
+            }
+
+            # 원본 해상도 통계를 변화량 맵 태그로 기록 (대시보드가 썸네일 대신 사용)
+            if valid_pixels:
+                change_dst.update_tags(
+                    DRY_MEAN_DB=f"{db_stats['dry_mean']:.4f}",
+                    FLOOD_MEAN_DB=f"{db_stats['flood_mean']:.4f}",
+                    CHANGE_MIN_DB=f"{db_stats['change_min']:.4f}",
+                    CHANGE_MAX_DB=f"{db_stats['change_max']:.4f}",
+                    CHANGE_MEAN_DB=f"{db_stats['dry_mean'] - db_stats['flood_mean']:.4f}",
+                )
+
+        # mask는 클래스 값이라 nearest, 변화량은 연속값이라 average
+        build_overviews(mask_path, Resampling.nearest)
+        build_overviews(change_path, Resampling.average)
+
+        total_pixels = flood_src.width * flood_src.height
+
+        return {
+            "shape": flood_src.shape,
+            "transform": flood_src.transform,
+            "crs": flood_src.crs,
+            "flood_pixels": int(row_flood_pixels.sum()),
+            "row_flood_pixels": row_flood_pixels,
+            "valid_pixels": valid_pixels,
+            "total_pixels": total_pixels,
+            **db_stats,
+        }
+
+
 def mask_to_vector(
     flood_mask: np.ndarray,
     transform: rasterio.Affine,
@@ -119,6 +314,9 @@ def mask_to_vector(
     """
     Binary mask를 벡터(GeoJSON)로 변환
 
+    폴리곤은 mask 픽셀 경계를 그대로 따릅니다 (flood_mask.tif와 동일한 면적).
+    표시용 단순화는 save_display_vector에서 따로 합니다.
+
     Args:
         flood_mask: Binary flood mask
         transform: GeoTIFF transform
@@ -127,36 +325,44 @@ def mask_to_vector(
     Returns:
         GeoDataFrame: 침수 영역 폴리곤
     """
-    # 래스터 → 벡터 변환
-    mask = flood_mask.astype(np.int16)
-    results = (
-        {"geometry": shape(geom), "flood": value}
-        for geom, value in shapes(mask, transform=transform)
-        if value == 1  # 침수 영역만
+    # 래스터 → 벡터 변환 (uint8 mask는 복사 없이 그대로, geometry 배열은 한 번에 생성)
+    mask = np.asarray(flood_mask, dtype=np.uint8)
+    geoms = np.fromiter(
+        (shape(geom) for geom, value in shapes(mask, transform=transform) if value == 1),  # 침수 영역만
+        dtype=object,
     )
 
-    gdf = gpd.GeoDataFrame.from_records(list(results))
-    if len(gdf) > 0:
-        gdf = gdf.set_geometry("geometry")
-        gdf = gdf.set_crs(crs)
+    gdf = gpd.GeoDataFrame(
+        {"flood": np.ones(len(geoms), dtype=np.int16)},
+        geometry=geoms,
+        crs=crs,
+    )
 
     return gdf
 
 
-def save_flood_mask(
-    flood_mask: np.ndarray,
-    profile: dict,
-    output_path: Path
+def save_display_vector(
+    flood_gdf: gpd.GeoDataFrame,
+    output_path: Path,
+    tolerance: float = 0.001
 ):
-    """Flood mask를 GeoTIFF로 저장"""
-    output_path.parent.mkdir(parents=True, exist_ok=True)
+    """
+    대시보드 표시용 벡터 저장 (단순화 + gzip GeoJSON)
+
+    앱이 로딩할 때마다 simplify 하지 않도록 미리 단순화해서 저장합니다.
 
-    profile.update(dtype=rasterio.uint8, count=1, nodata=255)
+    Args:
+        flood_gdf: 침수 영역 폴리곤
+        output_path: 출력 경로 (*.geojson.gz)
+        tolerance: 단순화 허용 오차 (좌표계 단위)
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with rasterio.open(output_path, 'w', **profile) as dst:
-        dst.write(flood_mask, 1)
+    display_gdf = flood_gdf.copy()
+    display_gdf["geometry"] = display_gdf.geometry.simplify(tolerance, preserve_topology=True)
 
-    print(f"Flood mask 저장: {output_path}")
+    with gzip.open(output_path, "wt", encoding="utf-8") as f:
+        f.write(display_gdf.to_json())
 
 
 def main():
@@ -166,61 +372,54 @@ def main():
     print("홍수 탐지 알고리즘 실행")
     print("=" * 50)
 
-    # 1. SAR 이미지 로드
-    print("\n[1/5] SAR 이미지 로딩...")
+    # 1. 블록 단위 Change Detection (flood mask / 변화량 맵 바로 저장)
+    print("\n[1/3] 블록 단위 Change Detection 수행...")
     dry_path = DATA_S1_RAW_DRY / "S1_dry_sample_VV.tif"
     flood_path = DATA_S1_RAW_FLOOD / "S1_flood_sample_VV.tif"
+    mask_output = DATA_INUNDATION_SEOUL_HANGANG_2KM / "flood_mask.tif"
+    change_output = DATA_INUNDATION_SEOUL_HANGANG_2KM / "change_map.tif"
 
-    dry_image, dry_meta = load_sar_image(dry_path)
-    flood_image, flood_meta = load_sar_image(flood_path)
-
-    print(f"  평시 이미지: {dry_image.shape}, mean={dry_image.mean():.2f} dB")
-    print(f"  홍수 이미지: {flood_image.shape}, mean={flood_image.mean():.2f} dB")
-
-    # 2. Change Detection
-    print("\n[2/5] Change Detection 수행...")
     threshold = 3.0  # dB
-    flood_mask, change_map = change_detection(dry_image, flood_image, threshold)
+    cd_stats = detect_flood_blocks(
+        dry_path, flood_path, mask_output, change_output, threshold
+    )
+    print(f"  평시 이미지: {cd_stats['shape']}, mean={cd_stats['dry_mean']:.2f} dB")
+    print(f"  홍수 이미지: {cd_stats['shape']}, mean={cd_stats['flood_mean']:.2f} dB")
     print(f"  임계값: {threshold} dB")
-    print(f"  변화량 범위: {change_map.min():.2f} ~ {change_map.max():.2f} dB")
-
-    # 3. 면적 계산
-    print("\n[3/5] 침수 면적 계산...")
-    area_stats = calculate_flood_area(
-        flood_mask,
-        flood_meta["transform"],
-        str(flood_meta["crs"])
+    print(f"  유효 픽셀: {cd_stats['valid_pixels']:,} / {cd_stats['total_pixels']:,}")
+    print(f"  변화량 범위: {cd_stats['change_min']:.2f} ~ {cd_stats['change_max']:.2f} dB")
+    print(f"  Flood mask 저장: {mask_output}")
+    print(f"  변화량 맵 저장: {change_output}")
+
+    # 2. 면적 계산
+    print("\n[2/3] 침수 면적 계산...")
+    area_stats = flood_area_stats(
+        cd_stats["row_flood_pixels"],
+        cd_stats["total_pixels"],
+        cd_stats["transform"],
+        cd_stats["crs"]
     )
     print(f"  침수 픽셀: {area_stats['flood_pixels']:,} / {area_stats['total_pixels']:,}")
     print(f"  침수 비율: {area_stats['flood_ratio']*100:.2f}%")
     print(f"  침수 면적: {area_stats['flood_area_km2']:.2f} km² ({area_stats['flood_area_ha']:.1f} ha)")
 
-    # 4. 결과 저장 (래스터)
-    print("\n[4/5] 결과 저장 (래스터)...")
-    mask_output = DATA_INUNDATION_SEOUL_HANGANG_2KM / "flood_mask.tif"
-    save_flood_mask(flood_mask, flood_meta["profile"], mask_output)
-
-    # 변화량 맵도 저장
-    change_output = DATA_INUNDATION_SEOUL_HANGANG_2KM / "change_map.tif"
-    change_profile = flood_meta["profile"].copy()
-    change_profile.update(dtype=rasterio.float32, count=1)
-    with rasterio.open(change_output, 'w', **change_profile) as dst:
-        dst.write(change_map.astype(np.float32), 1)
-    print(f"  변화량 맵 저장: {change_output}")
-
-    # 5. 벡터 변환
-    print("\n[5/5] 벡터 변환...")
-    flood_gdf = mask_to_vector(
-        flood_mask,
-        flood_meta["transform"],
-        str(flood_meta["crs"])
-    )
+    # 3. 벡터 변환 (폴리곤이 블록 경계에서 잘리지 않도록 저장된 mask 전체 사용)
+    print("\n[3/3] 벡터 변환...")
+    with rasterio.open(mask_output) as src:
+        flood_mask = src.read(1)
+        mask_transform = src.transform
+        mask_crs = src.crs
+    flood_gdf = mask_to_vector(flood_mask, mask_transform, str(mask_crs))
 
     if len(flood_gdf) > 0:
         vector_output = DATA_INUNDATION_SEOUL_HANGANG_2KM / "flood_areas.geojson"
         flood_gdf.to_file(vector_output, driver="GeoJSON")
         print(f"  벡터 저장: {vector_output}")
         print(f"  침수 폴리곤 수: {len(flood_gdf)}")
+
+        display_output = DATA_INUNDATION_SEOUL_HANGANG_2KM / "flood_areas.simplified.geojson.gz"
+        save_display_vector(flood_gdf, display_output)
+        print(f"  표시용 벡터 저장: {display_output}")
     else:
         print("  침수 영역 없음")
 
@@ -234,6 +433,7 @@ def main():
     print(f"  - {change_output}")
     if len(flood_gdf) > 0:
         print(f"  - {vector_output}")
+        print(f"  - {display_output}")
 
     return area_stats
 
@@ -13,6 +13,8 @@ SAR 특성:
 import numpy as np
 import geopandas as gpd
 import rasterio
+import shapely
+from rasterio.enums import Resampling
 from rasterio.transform import from_bounds
 from rasterio.features import rasterize
 from pathlib import Path
@@ -26,6 +28,7 @@ from paths import (
     DATA_S1_RAW_FLOOD,
     DATA_S1_RAW_DRY,
 )
+from flood_detection import DB_NODATA, DB_SCALE, GTIFF_WRITE_OPTIONS, build_overviews, quantize_db
 
 
 def create_base_image(
@@ -36,9 +39,9 @@ def create_base_image(
     """
     기본 SAR 배경 이미지 생성 (도시/초목 혼합)
     """
-    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
     # 도시/초목 혼합 배경 (-10 dB 기준)
-    base = np.random.normal(-8, 3, (height, width)).astype(np.float32)
+    base = rng.normal(-8, 3, (height, width)).astype(np.float32)
     return base
 
 
@@ -57,7 +60,11 @@ def rasterize_water(
     if len(water_gdf) == 0:
         return np.zeros((height, width), dtype=np.uint8)
 
-    shapes = [(geom, 1) for geom in water_gdf.geometry if geom is not None]
+    # AOI 범위와 겹치는 geometry만 골라서 래스터화 (범위 밖 geometry는 건너뜀)
+    geoms = water_gdf.geometry.values
+    tree = shapely.STRtree(geoms)
+    idx = tree.query(shapely.box(*bounds), predicate="intersects")
+    shapes = [(geom, 1) for geom in geoms[np.sort(idx)]]
 
     if not shapes:
         return np.zeros((height, width), dtype=np.uint8)
@@ -91,15 +98,15 @@ def generate_sar_image(
     Returns:
         SAR backscatter 이미지 (dB)
     """
-    np.random.seed(seed + 100)
+    rng = np.random.default_rng(seed + 100)
 
     result = base_image.copy()
     height, width = result.shape
 
-    # 물 영역: 낮은 backscatter
+    # 물 영역: 낮은 backscatter (물 픽셀 수만큼만 난수 생성)
     water_value = -18  # dB
-    water_noise = np.random.normal(water_value, 1.5, (height, width))
-    result[water_mask == 1] = water_noise[water_mask == 1]
+    w_idx = np.nonzero(water_mask == 1)
+    result[w_idx] = rng.normal(water_value, 1.5, size=w_idx[0].size)
 
     # 홍수 시: 물 영역 확장 (dilation)
     if flood_expansion > 0:
@@ -107,34 +114,32 @@ def generate_sar_image(
 
         # 물 영역을 확장 (dilation)
         expansion_pixels = int(max(height, width) * flood_expansion * 0.05)
-        if expansion_pixels > 0:
-            struct = ndimage.generate_binary_structure(2, 2)
-            expanded_mask = ndimage.binary_dilation(
-                water_mask,
-                structure=struct,
-                iterations=expansion_pixels
-            )
+        if expansion_pixels > 0 and water_mask.any():
+            # 3x3 구조요소로 N번 dilation == chessboard 거리 <= N
+            # (거리 변환 한 번으로 N회 반복 연산을 대체)
+            dist = ndimage.distance_transform_cdt(water_mask == 0, metric="chessboard")
+            expanded_mask = dist <= expansion_pixels
 
             # 새로 침수된 영역 (기존 물 영역 제외)
             new_flood = expanded_mask & (water_mask == 0)
 
             # 새 침수 영역: 약간 더 높은 backscatter (얕은 물)
             flood_value = -15  # dB
-            flood_noise = np.random.normal(flood_value, 2, (height, width))
-            result[new_flood] = flood_noise[new_flood]
+            f_idx = np.nonzero(new_flood)
+            result[f_idx] = rng.normal(flood_value, 2, size=f_idx[0].size)
 
             # 일부 랜덤 침수 패치 추가 (도시 침수)
+            # 위치/크기는 한 번에 뽑고, 루프는 패치 값 채우기만
             n_patches = int(15 * flood_expansion)
-            for _ in range(n_patches):
-                px = np.random.randint(0, width - 20)
-                py = np.random.randint(0, height - 15)
-                pw = np.random.randint(5, 20)
-                ph = np.random.randint(3, 15)
-                patch_value = np.random.normal(-14, 2, (ph, pw))
-                result[py:py+ph, px:px+pw] = patch_value
+            pxs = rng.integers(0, width - 20, size=n_patches)
+            pys = rng.integers(0, height - 15, size=n_patches)
+            pws = rng.integers(5, 20, size=n_patches)
+            phs = rng.integers(3, 15, size=n_patches)
+            for px, py, pw, ph in zip(pxs, pys, pws, phs):
+                result[py:py+ph, px:px+pw] = rng.normal(-14, 2, (ph, pw))
 
     # Speckle noise 추가 (SAR 특성)
-    speckle = np.random.exponential(1, (height, width)).astype(np.float32)
+    speckle = rng.exponential(1, (height, width)).astype(np.float32)
     speckle = np.clip(speckle, 0.3, 3.0)
     result = result * speckle
 
@@ -150,12 +155,15 @@ def save_geotiff(
     output_path: Path,
     crs: str = "EPSG:4326"
 ):
-    """GeoTIFF로 저장"""
+    """GeoTIFF로 저장 (dB 값을 int16, dB × DB_SCALE로 양자화)"""
     height, width = data.shape
     transform = from_bounds(*bounds, width, height)
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # read_db_int16과 같은 규칙: 범위 밖 값은 clip, NaN은 DB_NODATA
+    quantized = quantize_db(data * DB_SCALE)
+
     with rasterio.open(
         output_path,
         'w',
@@ -163,11 +171,18 @@ def save_geotiff(
         height=height,
         width=width,
         count=1,
-        dtype=data.dtype,
+        dtype=rasterio.int16,
+        nodata=DB_NODATA,
         crs=crs,
         transform=transform,
+        BIGTIFF="IF_SAFER",
+        **GTIFF_WRITE_OPTIONS,
     ) as dst:
-        dst.write(data, 1)
+        dst.scales = (1 / DB_SCALE,)
+        dst.offsets = (0.0,)
+        dst.write(quantized, 1)
+
+    build_overviews(output_path, Resampling.average)
 
     print(f"Saved: {output_path}")
 
@@ -182,8 +197,8 @@ def main():
 
     # 1. AOI 및 한강 데이터 로드
     print("\n[1/5] Loading vector data...")
-    aoi = gpd.read_file(AOI_SEOUL_HANGANG_2KM)
-    hangang = gpd.read_file(KOREA_RIVERS)
+    aoi = gpd.read_file(AOI_SEOUL_HANGANG_2KM, engine="pyogrio")
+    hangang = gpd.read_file(KOREA_RIVERS, engine="pyogrio")
 
     bounds = aoi.total_bounds  # (minx, miny, maxx, maxy)
     print(f"  AOI bounds: {bounds}")
@@ -194,8 +209,18 @@ def main():
     ]
     print(f"  Hangang features: {len(hangang_filtered)}")
 
-    # AOI와 교차하는 부분만
-    hangang_clipped = gpd.clip(hangang_filtered, aoi)
+    # AOI와 교차하는 부분만 (AOI는 단일 geometry → STRtree 조회 + 한 번의 intersection)
+    aoi_geom = shapely.union_all(aoi.geometry.values)
+    hangang_geoms = hangang_filtered.geometry.values
+    tree = shapely.STRtree(hangang_geoms)
+    idx = np.sort(tree.query(aoi_geom, predicate="intersects"))
+    clipped = shapely.intersection(hangang_geoms[idx], aoi_geom)
+    hangang_clipped = gpd.GeoDataFrame(
+        hangang_filtered.iloc[idx].drop(columns="geometry"),
+        geometry=clipped,
+        crs=hangang_filtered.crs,
+    )
+    hangang_clipped = hangang_clipped[~hangang_clipped.geometry.is_empty]
     print(f"  Clipped features: {len(hangang_clipped)}")
 
     # 2. 이미지 크기 설정
@@ -0,0 +1,51 @@
+# data/pixel_area.py
+"""
+래스터 픽셀 면적 계산
+
+flood_detection.py(CLI)와 service/app.py(대시보드)가 같은 침수 면적을
+내도록 행별 픽셀 면적 계산을 한 곳에 둡니다. numpy만 사용합니다.
+"""
+
+import numpy as np
+
+
+# WGS84 타원체 상수
+_WGS84_A = 6378137.0
+_WGS84_F = 1 / 298.257223563
+_WGS84_E = np.sqrt(_WGS84_F * (2 - _WGS84_F))
+_WGS84_B2 = _WGS84_A ** 2 * (1 - _WGS84_E ** 2)
+
+
+def _wgs84_band_area(lat_deg):
+    """적도~위도 사이 타원체(WGS84) 띠 면적, 경도 1 rad당 (m²)"""
+    sin_lat = np.sin(np.radians(lat_deg))
+    e_sin = _WGS84_E * sin_lat
+    return _WGS84_B2 * (
+        sin_lat / (2 * (1 - e_sin ** 2))
+        + np.log((1 + e_sin) / (1 - e_sin)) / (4 * _WGS84_E)
+    )
+
+
+def row_pixel_areas_m2(transform, crs, height: int) -> np.ndarray:
+    """
+    행별 픽셀 면적 (m²)
+
+    지리 좌표계(또는 CRS 없음 → WGS84로 간주)는 WGS84 타원체 위의 실제 셀 면적,
+    투영 좌표계는 |a·e| × 단위 환산으로 계산합니다. (north-up 래스터 전제)
+
+    Args:
+        transform: 래스터 Affine transform
+        crs: rasterio CRS (또는 None)
+        height: 래스터 행 수
+
+    Returns:
+        길이 height의 행별 픽셀 면적 배열
+    """
+    t = transform
+    if crs is not None and not crs.is_geographic:
+        unit_m = crs.linear_units_factor[1]
+        return np.full(height, abs(t.a * t.e) * unit_m ** 2)
+
+    lat_edges = t.f + t.e * np.arange(height + 1)
+    band = _wgs84_band_area(lat_edges)
+    return np.abs(np.diff(band)) * np.radians(abs(t.a))
@@ -5,100 +5,324 @@ Urban Flood Inundation Mapping with Sentinel-1 SAR
 """
 
 import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import folium
 import streamlit as st
-from streamlit_folium import st_folium
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
 import geopandas as gpd
 
 # 경로 설정
 ROOT = Path(__file__).resolve().parents[1]
+# 면적 계산은 CLI(flood_detection.py)와 같은 data/pixel_area.py를 사용
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from data.pixel_area import row_pixel_areas_m2  # noqa: E402
+
 DATA_DIR = ROOT / "data"
 VECTOR_DIR = DATA_DIR / "vector"
 PRODUCTS_DIR = DATA_DIR / "products" / "inundation" / "seoul_hangang_2km"
+AOI_PATH = VECTOR_DIR / "seoul_hangang_2km_aoi.geojson"
+FLOOD_AREAS_PATH = PRODUCTS_DIR / "flood_areas.geojson"
+FLOOD_MASK_PATH = PRODUCTS_DIR / "flood_mask.tif"
+# 원본 해상도 SAR 통계가 태그로 기록된 변화량 맵
+CHANGE_MAP_PATH = PRODUCTS_DIR / "change_map.tif"
+# flood_detection.py가 미리 단순화해서 저장한 표시용 벡터
+FLOOD_AREAS_DISPLAY_PATH = PRODUCTS_DIR / "flood_areas.simplified.geojson.gz"
+SAR_DRY_PATH = DATA_DIR / "sentinel1" / "raw" / "dry" / "S1_dry_sample_VV.tif"
+SAR_FLOOD_PATH = DATA_DIR / "sentinel1" / "raw" / "flood" / "S1_flood_sample_VV.tif"
+
+# 지도에 보내는 GeoJSON 좌표 소수 자릿수 (5자리 ≈ 1 m)
+GEOJSON_PRECISION = 5
+
+# GDAL 설정: 블록 캐시는 프로세스 전역이라 한 번 키워두면 로더 간에 재사용됨.
+# rasterio.Env는 스레드 로컬이므로 로더마다 같은 옵션으로 감싸서
+# rasterio.open 호출마다 기본 Env가 새로 생성/해제되지 않게 함
+GDAL_ENV_OPTIONS = {
+    "GDAL_CACHEMAX": 512,
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_USE_HEAD": "NO",
+}
+
+# SAR 탭 표시 해상도 (긴 변 픽셀 수). 브라우저에서 어차피 축소되므로 이 이상은 읽지 않음
+SAR_DISPLAY_MAX_SIDE = 1024
 
 # ---------- Data Loading ----------
 
-@st.cache_data
-def load_aoi():
-    """AOI GeoJSON 로드"""
-    aoi_path = VECTOR_DIR / "seoul_hangang_2km_aoi.geojson"
-    if aoi_path.exists():
-        return gpd.read_file(aoi_path)
-    return None
+def read_db(src, max_side=None):
+    """
+    밴드 1을 float32 dB로 읽기 (int16 양자화 파일은 scale/offset 적용, nodata는 NaN)
+
+    max_side를 주면 긴 변이 그 이하가 되도록 축소해서 읽습니다.
+    (overview가 있으면 GDAL이 overview에서 바로 읽음)
+    """
+    if max_side is None or max(src.width, src.height) <= max_side:
+        data = src.read(1, out_dtype=np.float32)
+    else:
+        factor = -(-max(src.width, src.height) // max_side)  # ceil
+        data = src.read(
+            1,
+            out_dtype=np.float32,
+            out_shape=(max(1, src.height // factor), max(1, src.width // factor)),
+            resampling=Resampling.average,
+        )
+    if src.nodata is not None:
+        data[data == src.nodata] = np.nan
+    data *= src.scales[0]
+    data += src.offsets[0]
+    return data
+
+
+def file_key(path: Path):
+    """캐시 키용 (경로, 수정 시각, 크기). 파일이 없으면 None"""
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return (str(path), stat.st_mtime_ns, stat.st_size)
 
 
-@st.cache_data
-def load_flood_areas():
-    """침수 영역 GeoJSON 로드"""
-    flood_path = PRODUCTS_DIR / "flood_areas.geojson"
-    if flood_path.exists():
-        gdf = gpd.read_file(flood_path)
-        # 단순화하여 로딩 속도 개선
-        gdf["geometry"] = gdf["geometry"].simplify(0.001)
-        return gdf
-    return None
+def iter_windows(src, size=1024):
+    """타일 GeoTIFF는 내부 블록 단위로, 아니면 size×size 윈도우로 순회"""
+    if src.profile.get("tiled"):
+        for _, window in src.block_windows(1):
+            yield window
+        return
+
+    for row in range(0, src.height, size):
+        for col in range(0, src.width, size):
+            yield Window(col, row, min(size, src.width - col), min(size, src.height - row))
+
+
+def _windows_overlap(a, b):
+    """두 Window가 면적을 갖고 겹치는지 (경계만 맞닿으면 False)"""
+    return (
+        a.col_off < b.col_off + b.width and b.col_off < a.col_off + a.width
+        and a.row_off < b.row_off + b.height and b.row_off < a.row_off + a.height
+    )
+
+
+def flood_row_counts(src, window=None):
+    """
+    행별 침수 픽셀 수 (래스터 전체 높이 길이의 배열)
+
+    블록 단위로 읽어서 카운트하므로 전체 래스터를 메모리에 올리지 않습니다.
+    window를 주면 그 영역과 겹치는 블록만 읽으므로(타일 GeoTIFF),
+    부분 AOI 질의도 파일 전체를 읽지 않고 처리할 수 있습니다.
+    래스터와 겹치지 않는 window는 전부 0을 반환합니다.
+    """
+    counts = np.zeros(src.height, dtype=np.int64)
+    full = Window(0, 0, src.width, src.height)
+    if window is None:
+        window = full
+    elif _windows_overlap(window, full):
+        window = window.intersection(full)
+    else:
+        return counts
+
+    for block_window in iter_windows(src):
+        if not _windows_overlap(block_window, window):
+            continue  # 질의 영역과 겹치지 않는 블록
+        read_window = block_window.intersection(window)
+        block = src.read(1, window=read_window)
+        row_off = int(read_window.row_off)
+        counts[row_off:row_off + block.shape[0]] += np.count_nonzero(block == 1, axis=1)
+    return counts
 
 
 @st.cache_data
-def load_flood_stats():
-    """침수 통계 계산"""
-    mask_path = PRODUCTS_DIR / "flood_mask.tif"
-    if not mask_path.exists():
+def load_aoi(aoi_key):
+    """AOI GeoJSON 로드 (키: file_key(AOI_PATH))"""
+    if aoi_key is None:
         return None
+    return gpd.read_file(AOI_PATH)
 
-    with rasterio.open(mask_path) as src:
-        mask = src.read(1)
-        transform = src.transform
 
-    # 픽셀 크기 계산 (서울 위도 기준)
-    lat_center = 37.55
-    m_per_deg_lat = 111320
-    m_per_deg_lon = 111320 * np.cos(np.radians(lat_center))
+def flood_areas_source():
+    """지도에 쓰는 침수 영역 파일 (표시용 파일이 있으면 그것)"""
+    if FLOOD_AREAS_DISPLAY_PATH.exists():
+        return FLOOD_AREAS_DISPLAY_PATH
+    return FLOOD_AREAS_PATH
 
-    pixel_width_m = abs(transform.a) * m_per_deg_lon
-    pixel_height_m = abs(transform.e) * m_per_deg_lat
-    pixel_area_m2 = pixel_width_m * pixel_height_m
 
-    flood_pixels = int(np.sum(mask == 1))
-    total_pixels = int(mask.size)
+@st.cache_data(persist="disk")
+def load_flood_areas(flood_key):
+    """
+    침수 영역 GeoJSON 로드
+
+    flood_key는 file_key(flood_areas_source()) 결과 (경로, mtime, 크기)라서
+    파일이 그대로면 앱 재시작/코드 변경 후에도 디스크 캐시를 재사용하고,
+    파일이 다시 생성되면 새로 읽습니다.
+    """
+    if flood_key is None:
+        return None
+    flood_path = Path(flood_key[0])
+    if flood_path == FLOOD_AREAS_DISPLAY_PATH:
+        # flood_detection.py가 미리 단순화해 둔 표시용 파일
+        return gpd.read_file(f"/vsigzip/{flood_path}")
+
+    gdf = gpd.read_file(flood_path)
+    # 표시용 파일이 없으면 여기서 단순화하여 로딩 속도 개선
+    gdf["geometry"] = gdf["geometry"].simplify(0.001)
+    return gdf
+
+
+@st.cache_data
+def load_flood_stats(mask_key):
+    """침수 통계 계산 (키: file_key(FLOOD_MASK_PATH))"""
+    if mask_key is None:
+        return None
+
+    with rasterio.Env(**GDAL_ENV_OPTIONS), rasterio.open(FLOOD_MASK_PATH) as src:
+        # 행별 침수 픽셀 수 (지리 좌표계에서는 행마다 픽셀 면적이 다름)
+        row_flood_pixels = flood_row_counts(src)
+        row_areas_m2 = row_pixel_areas_m2(src.transform, src.crs, src.height)
+        total_pixels = src.width * src.height
+
+    flood_pixels = int(row_flood_pixels.sum())
+    flood_area_m2 = float(row_flood_pixels @ row_areas_m2)
 
     return {
         "flood_pixels": flood_pixels,
         "total_pixels": total_pixels,
         "flood_ratio": flood_pixels / total_pixels if total_pixels > 0 else 0,
-        "flood_area_km2": flood_pixels * pixel_area_m2 / 1_000_000,
-        "flood_area_ha": flood_pixels * pixel_area_m2 / 10_000,
+        "flood_area_km2": flood_area_m2 / 1_000_000,
+        "flood_area_ha": flood_area_m2 / 10_000,
     }
 
 
 @st.cache_data
-def load_sar_images():
-    """SAR 이미지 로드"""
-    dry_path = DATA_DIR / "sentinel1" / "raw" / "dry" / "S1_dry_sample_VV.tif"
-    flood_path = DATA_DIR / "sentinel1" / "raw" / "flood" / "S1_flood_sample_VV.tif"
-
+def load_sar_images(dry_key, flood_key):
+    """SAR 이미지 로드 (표시용 해상도, 키: 두 SAR 파일의 경로/mtime/크기)"""
     images = {}
 
-    if dry_path.exists():
-        with rasterio.open(dry_path) as src:
-            images["dry"] = src.read(1)
-            images["bounds"] = src.bounds
+    with rasterio.Env(**GDAL_ENV_OPTIONS):
+        if SAR_DRY_PATH.exists():
+            with rasterio.open(SAR_DRY_PATH) as src:
+                images["dry"] = read_db(src, max_side=SAR_DISPLAY_MAX_SIDE)
+                images["bounds"] = src.bounds
 
-    if flood_path.exists():
-        with rasterio.open(flood_path) as src:
-            images["flood"] = src.read(1)
+        if SAR_FLOOD_PATH.exists():
+            with rasterio.open(SAR_FLOOD_PATH) as src:
+                images["flood"] = read_db(src, max_side=SAR_DISPLAY_MAX_SIDE)
 
     return images if images else None
 
 
+@st.cache_data
+def load_sar_stats(change_key):
+    """
+    SAR 탭 캡션용 원본 해상도 통계 (키: file_key(CHANGE_MAP_PATH))
+
+    flood_detection.py가 변화량 맵에 태그로 기록해 둔 값을 읽으므로
+    픽셀은 읽지 않습니다. 태그가 없으면 None (썸네일 통계 사용)
+    """
+    if change_key is None:
+        return None
+
+    with rasterio.Env(**GDAL_ENV_OPTIONS), rasterio.open(CHANGE_MAP_PATH) as src:
+        tags = src.tags()
+
+    try:
+        return {
+            "dry": {"mean": float(tags["DRY_MEAN_DB"])},
+            "flood": {"mean": float(tags["FLOOD_MEAN_DB"])},
+            "change": {
+                "min": float(tags["CHANGE_MIN_DB"]),
+                "max": float(tags["CHANGE_MAX_DB"]),
+                "mean": float(tags["CHANGE_MEAN_DB"]),
+            },
+        }
+    except KeyError:
+        return None
+
+
+def normalize_with_stats(arr):
+    """
+    min-max 정규화 + 통계
+
+    min/max/mean은 한 번씩만 계산하고, 정규화는 새 버퍼 하나에 in-place로 수행합니다.
+    nodata(NaN) 픽셀은 통계에서 빼고 표시할 때는 0(검정)으로 채웁니다.
+    """
+    mn, mx, mean = float(np.nanmin(arr)), float(np.nanmax(arr)), float(np.nanmean(arr))
+    out = np.empty(arr.shape, dtype=np.float32)
+    np.subtract(arr, mn, out=out)
+    out /= (mx - mn + 1e-6)
+    np.nan_to_num(out, copy=False, nan=0.0)
+    return out, {"min": mn, "max": mx, "mean": mean}
+
+
+@st.cache_data
+def load_sar_display(dry_key, flood_key):
+    """
+    SAR 탭 표시용 정규화 이미지 + 통계
+
+    두 SAR 파일의 키로 캐시되므로 파일이 바뀔 때만 다시 계산합니다.
+    """
+    images = load_sar_images(dry_key, flood_key)
+    if not images:
+        return None
+
+    display = {}
+    for name in ("dry", "flood"):
+        if name in images:
+            display[name] = normalize_with_stats(images[name])
+
+    # 변화량 (Dry - Flood): 미리 잡은 버퍼에 빼고, 통계는 정규화와 함께 한 번만
+    if "dry" in images and "flood" in images:
+        change = np.empty_like(images["dry"])
+        np.subtract(images["dry"], images["flood"], out=change)
+        display["change"] = normalize_with_stats(change)
+    return display
+
+
 # ---------- Map Creation ----------
 
-def create_flood_map(aoi_gdf, flood_gdf, center=(37.55, 126.99)):
-    """침수 영역 지도 생성"""
+def _round_coords(coords, ndigits):
+    """GeoJSON 좌표 배열(중첩 리스트)을 재귀적으로 반올림"""
+    if isinstance(coords, (int, float)):
+        return round(coords, ndigits)
+    return [_round_coords(c, ndigits) for c in coords]
+
+
+def compact_geojson(gdf, ndigits=GEOJSON_PRECISION):
+    """좌표를 ndigits 자리로 줄이고 공백 없이 직렬화한 GeoJSON 문자열"""
+    fc = json.loads(gdf.to_json())
+    for feature in fc["features"]:
+        geom = feature.get("geometry")
+        if geom and "coordinates" in geom:
+            geom["coordinates"] = _round_coords(geom["coordinates"], ndigits)
+    return json.dumps(fc, separators=(",", ":"))
+
+
+@st.cache_data
+def load_aoi_geojson(aoi_key):
+    """AOI GeoJSON 문자열 (키: AOI 파일의 경로/mtime/크기)"""
+    aoi_gdf = load_aoi(aoi_key)
+    if aoi_gdf is None:
+        return None
+    return compact_geojson(aoi_gdf)
+
+
+@st.cache_data
+def load_flood_geojson(flood_key, n=500):
+    """침수 영역 GeoJSON 문자열, 상위 n개만 (키: 침수 영역 파일의 경로/mtime/크기)"""
+    flood_gdf = load_flood_areas(flood_key)
+    if flood_gdf is None or len(flood_gdf) == 0:
+        return None
+    # 너무 많은 폴리곤은 성능 이슈 → 상위 n개만
+    return compact_geojson(flood_gdf.head(n))
+
+
+def create_flood_map(aoi_geojson, flood_geojson, center=(37.55, 126.99)):
+    """침수 영역 지도 생성 (GeoJSON 문자열 입력)"""
     m = folium.Map(
         location=center,
         zoom_start=11,
@@ -106,9 +330,9 @@ def create_flood_map(aoi_gdf, flood_gdf, center=(37.55, 126.99)):
     )
 
     # AOI 경계 표시
-    if aoi_gdf is not None:
+    if aoi_geojson is not None:
         folium.GeoJson(
-            aoi_gdf.to_json(),
+            aoi_geojson,
             name="AOI (한강 2km 버퍼)",
             style_function=lambda x: {
                 "fillColor": "transparent",
@@ -119,12 +343,9 @@ def create_flood_map(aoi_gdf, flood_gdf, center=(37.55, 126.99)):
         ).add_to(m)
 
     # 침수 영역 표시
-    if flood_gdf is not None and len(flood_gdf) > 0:
-        # 너무 많은 폴리곤은 성능 이슈 → 상위 500개만
-        flood_sample = flood_gdf.head(500)
-
+    if flood_geojson is not None:
         folium.GeoJson(
-            flood_sample.to_json(),
+            flood_geojson,
             name="침수 영역",
             style_function=lambda x: {
                 "fillColor": "#ff4444",
@@ -140,6 +361,17 @@ def create_flood_map(aoi_gdf, flood_gdf, center=(37.55, 126.99)):
     return m
 
 
+@st.cache_data
+def render_flood_map(aoi_key, flood_key):
+    """
+    지도 HTML을 한 번만 렌더링해서 재사용
+
+    키는 입력 파일의 (경로, mtime, 크기)라서 파일이 바뀔 때만 다시 렌더링합니다.
+    """
+    m = create_flood_map(load_aoi_geojson(aoi_key), load_flood_geojson(flood_key))
+    return m.get_root().render()
+
+
 # ---------- Streamlit App ----------
 
 st.set_page_config(
@@ -151,15 +383,32 @@ st.set_page_config(
 st.title("🌊 Urban Flood Inundation Mapping")
 st.caption("서울/한강 지역 도시 홍수 침수 분석 | Sentinel-1 SAR 기반")
 
-# 데이터 로드
-aoi = load_aoi()
-flood_areas = load_flood_areas()
-stats = load_flood_stats()
-sar_images = load_sar_images()
+# 데이터 로드 (서로 독립적인 로더라 첫 실행 시 디스크 I/O가 겹치도록 병렬로)
+# 캐시 hit도 역직렬화된 복사본을 돌려주므로 화면에 실제로 쓰는 결과만 받음
+# (지도 HTML은 render_flood_map이 AOI/침수 영역 캐시를 함께 채움)
+_script_ctx = get_script_run_ctx()
+sar_keys = (file_key(SAR_DRY_PATH), file_key(SAR_FLOOD_PATH))
+flood_areas_key = file_key(flood_areas_source())
+aoi_key = file_key(AOI_PATH)
+mask_key = file_key(FLOOD_MASK_PATH)
+change_key = file_key(CHANGE_MAP_PATH)
+with ThreadPoolExecutor(
+    max_workers=4,
+    initializer=add_script_run_ctx,
+    initargs=(None, _script_ctx),
+) as ex:
+    futures = [
+        ex.submit(render_flood_map, aoi_key, flood_areas_key),
+        ex.submit(load_flood_stats, mask_key),
+        ex.submit(load_sar_display, *sar_keys),
+        ex.submit(load_sar_stats, change_key),
+    ]
+    flood_map_html, stats, sar_display, sar_stats = (f.result() for f in futures)
+sar_stats = sar_stats or {}
 
 # 데이터 확인
 data_ready = all([
-    aoi is not None,
+    aoi_key is not None,
     stats is not None,
 ])
 
@@ -202,9 +451,8 @@ with tab1:
     with col3:
         st.metric("침수 픽셀", f"{stats['flood_pixels']:,}")
 
-    # 지도 표시
-    flood_map = create_flood_map(aoi, flood_areas)
-    st_folium(flood_map, width=None, height=500, use_container_width=True)
+    # 지도 표시 (미리 렌더링된 HTML → rerun마다 folium 렌더링 없음)
+    components.html(flood_map_html, height=500)
 
     st.caption("🔴 빨간 영역: 침수 추정 지역 | 🔵 파란 점선: AOI 경계")
 
@@ -212,31 +460,33 @@ with tab1:
 with tab2:
     st.subheader("SAR 이미지 비교")
 
-    if sar_images:
+    if sar_display:
         col1, col2 = st.columns(2)
 
         with col1:
             st.markdown("**평시 (Dry Season)**")
-            if "dry" in sar_images:
+            if "dry" in sar_display:
                 # 정규화하여 표시
-                dry_norm = (sar_images["dry"] - sar_images["dry"].min()) / (sar_images["dry"].max() - sar_images["dry"].min() + 1e-6)
-                st.image(dry_norm, caption=f"Mean: {sar_images['dry'].mean():.2f} dB", use_container_width=True)
+                dry_norm, dry_stats = sar_display["dry"]
+                dry_stats = sar_stats.get("dry", dry_stats)  # 원본 해상도 통계 (없으면 썸네일)
+                st.image(dry_norm, caption=f"Mean: {dry_stats['mean']:.2f} dB", use_container_width=True)
 
         with col2:
             st.markdown("**홍수기 (Flood Season)**")
-            if "flood" in sar_images:
-                flood_norm = (sar_images["flood"] - sar_images["flood"].min()) / (sar_images["flood"].max() - sar_images["flood"].min() + 1e-6)
-                st.image(flood_norm, caption=f"Mean: {sar_images['flood'].mean():.2f} dB", use_container_width=True)
+            if "flood" in sar_display:
+                flood_norm, flood_stats = sar_display["flood"]
+                flood_stats = sar_stats.get("flood", flood_stats)
+                st.image(flood_norm, caption=f"Mean: {flood_stats['mean']:.2f} dB", use_container_width=True)
 
         # 변화량 표시
-        if "dry" in sar_images and "flood" in sar_images:
+        if "change" in sar_display:
             st.markdown("---")
             st.markdown("**변화량 (Dry - Flood)**")
-            change = sar_images["dry"] - sar_images["flood"]
+            change_norm, change_stats = sar_display["change"]
+            change_stats = sar_stats.get("change", change_stats)
 
             # 변화량을 컬러맵으로 표시
-            change_norm = (change - change.min()) / (change.max() - change.min() + 1e-6)
-            st.image(change_norm, caption=f"Range: {change.min():.2f} ~ {change.max():.2f} dB", use_container_width=True)
+            st.image(change_norm, caption=f"Range: {change_stats['min']:.2f} ~ {change_stats['max']:.2f} dB", use_container_width=True)
             st.caption("밝은 영역: backscatter 감소 (침수 가능성 높음)")
     else:
         st.info("SAR 이미지가 없습니다.")